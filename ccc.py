@@ -7,10 +7,10 @@ Copyright 2025 Damian Yerrick
 SPDX-License-Identifier: Zlib
 """
 import os, sys, argparse, subprocess, struct
+from array import array
 from collections import Counter
-from operator import or_ as bitor
-from functools import reduce
 from PIL import Image, ImageChops
+from cccframe import CCCFrame, CCC_SIZE
 
 bayer_src = bytes(int(x, 16) for x in "0C3F84B72E1DA695")
 def make_bayer_img(size, scale=1, offset=128):
@@ -25,34 +25,49 @@ def make_bayer_img(size, scale=1, offset=128):
     rows = (rows * -(-height // PATHEIGHT))[:height]
     return Image.frombytes("L", size, b"".join(rows))
 
+def parse_size(s):
+    """Parse a size such as 256x144 into a 2-tuple of ints."""
+    width, height = s.strip().lower().split("x")[:2]
+    return int(width), int(height)
+
 def ffprobe_size(filename):
-    args = ["ffprobe", "-show_streams", filename]
+    args = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height", "-of", "csv=p=0:s=x",
+        filename
+    ]
     result = subprocess.run(args, capture_output=True, encoding="utf-8")
     if result.returncode:
         sys.stderr.write(result.stderr)
         result.check_returncode()
-    nvps = [line.strip().split("=", 1) for line in result.stdout.split('\n')]
-    width = height = None
-    for line in nvps:
-        if len(line) < 2: continue
-        if line[0] == "width": width = int(line[1])
-        if line[0] == "height": height = int(line[1])
-        if width is not None and height is not None: return width, height
-    raise ValueError("ffprobe returned no width and height")
-
-def get_frames(filename, size):
+    try:
+        return parse_size(result.stdout)
+    except ValueError:
+        raise ValueError("ffprobe returned no width and height")
+
+def get_frames(filename, size, skip_frames=0):
+    """Decode a video to RGB frames with FFmpeg.
+
+skip_frames -- number of frames at the start to read and discard
+    without yielding, such as those already encoded; this counts
+    exactly the frames that FFmpeg outputs, which seeking by
+    timestamp with -ss would not guarantee
+"""
     args = [
         "ffmpeg", "-i", filename,
         "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
     ]
     proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+    frame_bytes = size[0] * size[1] * 3
+    for i in range(skip_frames):
+        if len(proc.stdout.read(frame_bytes)) < frame_bytes: return
     while True:
-        im = proc.stdout.read(size[0] * size[1] * 3)
+        im = proc.stdout.read(frame_bytes)
         if not im: break
         yield im
 
-def PIL_get_frames(filename, size):
-    for rawim in get_frames(filename, size):
+def PIL_get_frames(filename, size, skip_frames=0):
+    for rawim in get_frames(filename, size, skip_frames):
         yield Image.frombytes("RGB", size, rawim)
 
 def get_palim(filename):
@@ -93,8 +108,25 @@ def uniq_to_indices(seq):
         out[el].append(i)
     return out
 
-CCC_SIZE = (4, 4)
-def ccc_quantize_frame(im, bayer, palim, trace=False, use_population=False):
+# Translation table from shape pixels (color pair indices) to digits
+# for int(..., 2)
+SHAPE_DIGITS = b"01" + bytes(254)
+
+def ccc_quantize_frame(im, bayer, palim, trace=False, use_population=False,
+                       search_tables=None):
+    """Find a color pair and shape for each block of a frame.
+
+im -- an RGB image whose size is a multiple of CCC_SIZE
+bayer -- an RGB dither pattern image the same size as im
+palim -- a P image whose first 16 palette entries are the colors
+trace -- if true, show the initial color pair choices
+search_tables -- if not None, the result of ccc_pair_search_tables()
+    for this palette; score the luma, population, and nearest
+    palette neighbor pairs by reconstruction error, and keep the
+    best; see ccc_search_pairs()
+
+Return a CCCFrame.
+"""
 
     # Find which 2 colors in the palette best represent each block.
     dithered = ImageChops.add(im, bayer, offset=-128)
@@ -135,19 +167,26 @@ def ccc_quantize_frame(im, bayer, palim, trace=False, use_population=False):
         for lcp, pcp in zip(luma_colorpairs, pop_colorpairs)
     ]
 
+    if search_tables is not None:
+        return ccc_search_pairs(
+            dithered, search_tables,
+            [blk_colorpairs, luma_colorpairs, pop_colorpairs]
+        )
+    palette_colors = get_palette_colors(palim)
+
     # Make an image from the blocks that use each color pair, and
     # quantize it to only those two colors to find the shapes of
     # blocks using that pair
-    palette_size = 16
-    palette_colors = bytes(palim.getpalette())
-    palette_colors = [palette_colors[i:i + 3]
-                      for i in range(0, palette_size * 3, 3)]
     dithered_blks = imtoblocks(dithered, CCC_SIZE)
     palim_this_pair = Image.new("P", CCC_SIZE)
-    blk_shapes = [None] * len(blk_colorpairs)
+    frame = CCCFrame.zeros(len(blk_colorpairs))
+    colors, shapes = frame.colors, frame.shapes
+    block_px = CCC_SIZE[0] * CCC_SIZE[1]
     colorpair_indices = uniq_to_indices(blk_colorpairs)
     for colorpair, indices in colorpair_indices.items():
-        if len(colorpair) < 2: continue
+        if len(colorpair) < 2:
+            for i in indices: colors[i] = colorpair[0] * 0x11
+            continue
         imdata = b''.join(dithered_blks[i] for i in indices)
         dithered_this_pair = Image.frombytes(
             dithered.mode, (CCC_SIZE[0], CCC_SIZE[1] * len(indices)),
@@ -158,11 +197,118 @@ def ccc_quantize_frame(im, bayer, palim, trace=False, use_population=False):
         shapes_this_pair = dithered_this_pair.quantize(
             palette=palim_this_pair, dither=Image.Dither.NONE
         )
-        assert max(shapes_this_pair.tobytes()) < 2
-        shapes_this_pair = imtoblocks(shapes_this_pair, CCC_SIZE)
-        for i, shape in zip(indices, shapes_this_pair):
-            blk_shapes[i] = shape
-    return blk_colorpairs, blk_shapes
+        shapes_this_pair = shapes_this_pair.tobytes()
+        assert max(shapes_this_pair) < 2
+        # The image is one block wide, so each block's pixels are
+        # consecutive
+        shape_digits = shapes_this_pair.translate(SHAPE_DIGITS)
+        color = colorpair[0] << 4 | colorpair[1]
+        for i, start in zip(indices, range(0, len(shape_digits), block_px)):
+            colors[i] = color
+            shapes[i] = int(shape_digits[start:start + block_px], 2)
+    return frame
+
+def get_palette_colors(palim, palette_size=16):
+    """List the first palette_size colors of a P image as 3-byte strings."""
+    palette_colors = bytes(palim.getpalette())
+    return [palette_colors[i:i + 3]
+            for i in range(0, palette_size * 3, 3)]
+
+def palette_distances(palette_colors):
+    """Calculate squared RGB distances between all pairs of colors.
+
+palette_colors -- a list of (r, g, b) sequences
+
+Return a numpy array of shape (n, n).
+"""
+    import numpy as np
+
+    pal = np.array([tuple(c) for c in palette_colors], dtype=np.int32)
+    diff = pal[:, np.newaxis, :] - pal[np.newaxis, :, :]
+    return (diff * diff).sum(axis=2)
+
+def ccc_pair_search_tables(palette_colors, neighbors=2):
+    """Precompute palette lookups for ccc_search_pairs().
+
+palette_colors -- a list of 16 (r, g, b) sequences
+neighbors -- also try replacing either color of each initial pair
+    with one of this many closest colors in the palette
+
+These depend only on the palette, so compute them once per video.
+
+Return a 2-tuple (pal, nearest) of numpy arrays: the palette with
+shape (n, 3) and each color's nearest other colors with shape
+(n, neighbors).
+"""
+    import numpy as np
+
+    pal = np.array([tuple(c) for c in palette_colors], dtype=np.int32)
+    pair_dist = palette_distances(palette_colors)
+    # Column 0 of each row is usually the color itself
+    nearest = np.argsort(pair_dist, axis=1, kind="stable")
+    return pal, nearest[:, 1:neighbors + 1]
+
+def ccc_search_pairs(dithered, search_tables, initial_pairs):
+    """Choose each block's color pair by measured reconstruction error.
+
+dithered -- an RGB image whose size is a multiple of CCC_SIZE
+search_tables -- result of ccc_pair_search_tables()
+initial_pairs -- a list of candidate lists, each containing one 1- or
+    2-tuple of palette indices per block; ties go to earlier lists
+
+Each candidate pair is scored by assigning each pixel of the dithered
+block to the closer of its two colors and summing the squared RGB
+error.  All blocks are scored at once using numpy.
+
+Return a CCCFrame.
+"""
+    import numpy as np
+
+    pal, nearest = search_tables
+    palette_size = len(pal)
+
+    # Rearrange pixels to (block, pixel in block, RGB)
+    bw, bh = CCC_SIZE
+    w, h = dithered.size
+    px = np.asarray(dithered, dtype=np.int32)
+    px = px.reshape(h // bh, bh, w // bw, bw, 3)
+    px = px.transpose(0, 2, 1, 3, 4).reshape(-1, bw * bh, 3)
+
+    # Squared distance from each pixel to each palette entry
+    # shape (block, pixel, palette entry)
+    px_dist = np.zeros(px.shape[:2] + (palette_size,), dtype=np.int32)
+    for c in range(3):
+        diff = px[:, :, c:c + 1] - pal[np.newaxis, np.newaxis, :, c]
+        px_dist += diff * diff
+
+    # Gather candidate pairs with shape (block, candidate, 2)
+    cands = [np.array([p if len(p) > 1 else p * 2 for p in pairs],
+                      dtype=np.intp)
+             for pairs in initial_pairs]
+    for pairs in cands[:len(initial_pairs)]:
+        for n in range(nearest.shape[1]):
+            cands.append(np.stack([nearest[pairs[:, 0], n], pairs[:, 1]], 1))
+            cands.append(np.stack([pairs[:, 0], nearest[pairs[:, 1], n]], 1))
+    cands = np.stack(cands, axis=1)
+
+    # Score each candidate by its error after shape assignment
+    dist0 = np.take_along_axis(px_dist, cands[:, np.newaxis, :, 0], axis=2)
+    dist1 = np.take_along_axis(px_dist, cands[:, np.newaxis, :, 1], axis=2)
+    err = np.minimum(dist0, dist1).sum(axis=1)
+    best = err.argmin(axis=1)
+    rows = np.arange(len(best))
+    best_pairs = cands[rows, best]
+    best_shapes = dist1[rows, :, best] < dist0[rows, :, best]
+
+    # Pack shapes with the top left pixel in bit 15
+    bit_values = 1 << np.arange(bw * bh - 1, -1, -1)
+    shapes = (best_shapes * bit_values).sum(axis=1)
+    c0, c1 = best_pairs[:, 0], best_pairs[:, 1]
+    is_solid = c0 == c1
+    colors = np.where(is_solid, c0 * 0x11, c0 << 4 | c1)
+    shapes = np.where(is_solid, 0, shapes)
+    return CCCFrame(array("B", colors.astype(np.uint8).tobytes()),
+                    array("H", shapes.astype(np.uint16).tobytes()))
 
 def ccc_form_header(video_size, palim):
     """
@@ -179,25 +325,46 @@ frames
     ]
     return b''.join(out)
 
-def ccc_form_frame(blk_colorpairs, blk_shapes):
-    out = bytearray()
-    for colorpair, shape in zip(blk_colorpairs, blk_shapes):
-        shape = (reduce(bitor,
-                        (0x8000 >> i for i, c in enumerate(shape) if c),
-                        0)
-                 if shape
-                 else 0)
+def ccc_form_frame(frame):
+    """Convert a CCCFrame to bytes, storing all-0 and all-1 shapes as solid."""
+    colors = array("B", frame.colors)
+    shapes = array("H", frame.shapes)
+    for i, shape in enumerate(shapes):
         if shape == 0xFFFF:
-            colorpair, shape = colorpair[1:], 0
-        if len(colorpair) < 2 or shape == 0:
-            out.append(colorpair[0] * 0x11)
-            out.append(0)
-            out.append(0)
-            continue
-        out.append(colorpair[0] << 4 | colorpair[1])
-        out.append(shape >> 8)
-        out.append(shape & 0xFF)
-    return bytes(out)
+            colors[i] = (colors[i] & 0x0F) * 0x11
+            shapes[i] = 0
+        elif shape == 0:
+            colors[i] = (colors[i] >> 4) * 0x11
+    return CCCFrame(colors, shapes).to_bytes()
+
+def ccc_count_frames(filename, header, frame_bytes):
+    """Count whole frames in a partially written CCC file.
+
+filename -- path to a file that may have been left by an interrupted
+    encode
+header -- the header that the encode would write, which must match
+    the existing file's header
+frame_bytes -- size of one uncompressed frame
+
+Because each frame is coded independently, the whole frames already
+in the file are all the state an encode needs to continue.  The last
+whole frame is the previous-frame context for anything that uses one.
+
+Return the number of whole frames, or 0 if the file does not exist
+or is shorter than the header.  Raise ValueError if the header
+differs, such as if the video or palette changed.
+"""
+    try:
+        file_size = os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+    if file_size < len(header): return 0
+    with open(filename, "rb") as infp:
+        old_header = infp.read(len(header))
+    if old_header != header:
+        raise ValueError("%s: header does not match this video and palette"
+                         % filename)
+    return (file_size - len(header)) // frame_bytes
 
 def parse_argv(argv):
     p = argparse.ArgumentParser(
@@ -208,28 +375,69 @@ def parse_argv(argv):
     p.add_argument("output", help="write uncompressed CCC file")
     p.add_argument("--trace-frame", type=int,
                    help="frame number to draw")
+    p.add_argument("--size", type=parse_size,
+                   help="video size, such as 256x144 (default: ask ffprobe)")
+    p.add_argument("--quality", action="store_true",
+                   help="choose each block's color pair by lowest error "
+                        "among luma, population, and nearby colors; "
+                        "requires numpy")
+    p.add_argument("--neighbors", type=int, default=2, metavar="N",
+                   help="with --quality, also try each color's N closest "
+                        "colors in the palette (default 2)")
+    p.add_argument("--resume", action="store_true",
+                   help="continue after the last whole frame of an "
+                        "existing output file")
+    p.add_argument("--checkpoint-interval", type=int, default=60,
+                   metavar="FRAMES",
+                   help="flush output to disk every FRAMES frames "
+                        "so that --resume loses little (default 60)")
     return p.parse_args(argv[1:])
 
 def main(argv=None):
     args = parse_argv(argv or sys.argv)
     if args.trace_frame is not None:
         import cccdec
-    video_size = ffprobe_size(args.input)
+    video_size = args.size or ffprobe_size(args.input)
     bayer = make_bayer_img(video_size, 2, 129).convert("RGB")
     palim = get_palim(args.palette)
-    src = PIL_get_frames(args.input, video_size)
+    header = ccc_form_header(video_size, palim)
+    search_tables = (ccc_pair_search_tables(get_palette_colors(palim),
+                                            args.neighbors)
+                     if args.quality else None)
+    frame_bytes = ((video_size[0] // CCC_SIZE[0])
+                   * (video_size[1] // CCC_SIZE[1]) * 3)
+    start_frame = 0
+    if args.resume:
+        try:
+            start_frame = ccc_count_frames(args.output, header, frame_bytes)
+        except ValueError as e:
+            print("ccc.py: cannot resume:", e, file=sys.stderr)
+            sys.exit(1)
+        if start_frame:
+            print("resuming after frame %d" % (start_frame - 1))
+    src = PIL_get_frames(args.input, video_size, start_frame)
 
-    with open(args.output, "wb") as outfp:
-        outfp.write(ccc_form_header(video_size, palim))
-        for i, im in enumerate(src):
+    with open(args.output, "r+b" if start_frame else "wb") as outfp:
+        if start_frame:
+            # Discard a partial frame left by an interrupted encode
+            outfp.truncate(len(header) + start_frame * frame_bytes)
+            outfp.seek(0, os.SEEK_END)
+        else:
+            outfp.write(header)
+        for i, im in enumerate(src, start_frame):
             trace = i == args.trace_frame
             sec, subsec = divmod(i, 12)
             if subsec == 0 and sec % 5 == 0:
                 print("%d:%02d" % (sec // 60, sec % 60))
-            result = ccc_quantize_frame(im, bayer, palim, trace=trace)
-            outfp.write(ccc_form_frame(*result))
+            result = ccc_quantize_frame(im, bayer, palim, trace=trace,
+                                        search_tables=search_tables)
+            outfp.write(ccc_form_frame(result))
+            if (args.checkpoint_interval > 0
+                and (i + 1) % args.checkpoint_interval == 0):
+                outfp.flush()
+                os.fsync(outfp.fileno())
             if trace:
-                cccdec.ccc_restore_frame(video_size[0], palim, *result).show()
+                cccdec.ccc_restore_frame(video_size[0], palim, result).show()
                 break
 
 if __name__=='__main__':
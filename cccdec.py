@@ -5,29 +5,18 @@ Decompresses a Color Cell Compression video
 Copyright 2025 Damian Yerrick
 SPDX-License-Identifier: Zlib
 """
-import os, sys, argparse, subprocess, struct
+import os, sys, argparse, subprocess
 from PIL import Image
-
-HEADER_SIZE = 52
-CCC_SIZE = (4, 4)
+from cccframe import CCCFrame, HEADER_SIZE, CCC_SIZE, unpack_header
 
 def ccc_unpack_header(header):
-    video_size = struct.unpack(">HH", header[0:4])
-    palette = header[4:52]
+    video_size, palette = unpack_header(header)
     palim = Image.new("P", video_size)
     palim.putpalette(palette)
     return video_size, palim
 
 def ccc_unpack_frame(frame):
-    blk_colorpairs = []
-    blk_shapes = []
-    for i in range(0, len(frame), 3):
-        blk_colorpairs.append((frame[i] >> 4, frame[i] & 0x0F))
-        shape_bin = frame[i + 1] << 8 | frame[i + 2]
-        blk_shapes.append(bytes([1 if (0x8000 >> i) & shape_bin else 0
-                                 for i in range(16)]))
-##        print("%04X %s" % (shape_bin, blk_shapes[-1].hex()))
-    return blk_colorpairs, blk_shapes
+    return CCCFrame.from_bytes(frame)
 
 def blockstoimdata(blocks, width, block_size):
     width_blocks = width // block_size[0]
@@ -41,17 +30,78 @@ def blockstoimdata(blocks, width, block_size):
         )
     return b''.join(scanlines)
 
-def ccc_restore_frame(width, palim, blk_colorpairs, blk_shapes):
-    decoded_blocks = []
-    for colorpair, shape in zip(blk_colorpairs, blk_shapes):
-        if len(colorpair) < 2: shape = bytes(16)
-        decoded_blocks.append(bytes(colorpair[i] for i in shape))
+# Color pair indices of the 8 pixels in each byte of a shape
+SHAPE_HALVES = [bytes((b >> (7 - i)) & 1 for i in range(8))
+                for b in range(256)]
+# Translation tables from color pair indices to each pair's colors
+COLORPAIR_TABLES = [bytes((c >> 4, c & 0x0F)) + bytes(254)
+                    for c in range(256)]
+
+def ccc_restore_indices(width, frame):
+    """Decode a CCCFrame to one palette index byte per pixel."""
+    halves, tables = SHAPE_HALVES, COLORPAIR_TABLES
+    decoded_blocks = [
+        (halves[shape >> 8] + halves[shape & 0xFF]).translate(tables[color])
+        for color, shape in frame
+    ]
+    return blockstoimdata(decoded_blocks, width, CCC_SIZE)
 
-    imdata = blockstoimdata(decoded_blocks, width, CCC_SIZE)
+def ccc_restore_frame(width, palim, frame):
+    imdata = ccc_restore_indices(width, frame)
     out = Image.frombytes("P", (width, len(imdata) // width), imdata)
     out.putpalette(palim.getpalette())
     return out
 
+def make_rgb_expander(palette, size, scale=1, use_numpy=True):
+    """Make a function that converts palette indices to enlarged RGB.
+
+palette -- 48 bytes of 16 RGB colors
+size -- (width, height) of the indices in pixels
+scale -- integer factor by which to enlarge each pixel
+use_numpy -- if false, or if numpy is not installed, convert and
+    enlarge with Pillow, which gives the same result more slowly
+
+The returned function takes bytes of palette indices, such as from
+ccc_restore_indices(), and returns rgb24 data.  With numpy, this is
+written into a buffer that is allocated once and reused on every
+call, and it remains valid only until the next call.
+"""
+    width, height = size
+    if use_numpy:
+        try:
+            import numpy as np
+        except ImportError:
+            use_numpy = False
+
+    if use_numpy:
+        # Each pixel's color is repeated scale times across, and each
+        # row is repeated scale times down
+        lut = b"".join(bytes(palette[i:i + 3]) * scale
+                       for i in range(0, 48, 3))
+        lut = np.frombuffer(lut, dtype=np.uint8).reshape(16, -1)
+        row = np.empty((height, width, lut.shape[1]), dtype=np.uint8)
+        out = np.empty((height, scale, row.shape[1] * row.shape[2]),
+                       dtype=np.uint8)
+        out_view = out.reshape(-1)
+        def expand(indices):
+            idx = np.frombuffer(indices, dtype=np.uint8).reshape(height, width)
+            np.take(lut, idx, axis=0, out=row)
+            out[...] = row.reshape(height, 1, -1)
+            return out_view
+        return expand
+
+    # Converting to RGB before enlarging is faster than after
+    src = Image.new("P", size)
+    src.putpalette(palette)
+    out_size = (width * scale, height * scale)
+    def expand(indices):
+        src.frombytes(indices)
+        out = src.convert("RGB")
+        if scale != 1:
+            out = out.resize(out_size, Image.Resampling.NEAREST)
+        return out.tobytes()
+    return expand
+
 def parse_trace_frame(framenum):
     if not framenum: return None
     eq = framenum.split("=", 1)
@@ -67,20 +117,34 @@ def parse_argv(argv):
     p.add_argument("output", help="output video file")
     p.add_argument("--trace-frame", type=parse_trace_frame,
                    help="frame number to show or save, e.g. 123 or 100=out.png")
-    return p.parse_args(argv[1:])
+    p.add_argument("--scale", type=int, default=2,
+                   help="integer factor by which to enlarge (default 2)")
+    p.add_argument("--ffmpeg-scale", action="store_true",
+                   help="have FFmpeg enlarge frames instead of Python")
+    args = p.parse_args(argv[1:])
+    if args.scale < 1:
+        p.error("--scale must be at least 1")
+    return args
 
 def main(argv=None):
     args = parse_argv(argv or sys.argv)
     with open(args.input, "rb") as infp:
         header = infp.read(HEADER_SIZE)
-        video_size, palim = ccc_unpack_header(header)
-        out_size = (video_size[0] * 2, video_size[1] * 2)
+        video_size, palette = unpack_header(header)
+        py_scale = 1 if args.ffmpeg_scale else args.scale
+        out_size = (video_size[0] * py_scale, video_size[1] * py_scale)
         dstcmd = """
 ffmpeg -y -f rawvideo -pix_fmt rgb24 -r 12 -s %dx%d -an -i -
 -crf 28 -pix_fmt yuv420p -movflags +faststart
 """ % out_size
         dstcmd = dstcmd.split()
+        if args.ffmpeg_scale and args.scale != 1:
+            dstcmd.extend([
+                "-vf", "scale=iw*%d:ih*%d:flags=neighbor"
+                % (args.scale, args.scale)
+            ])
         dstcmd.append(args.output)
+        expand = make_rgb_expander(palette, video_size, py_scale)
         width_in_cells = video_size[0] // CCC_SIZE[0]
         height_in_cells = video_size[1] // CCC_SIZE[1]
         frame_length_in_bytes = width_in_cells * height_in_cells * 3
@@ -92,16 +156,15 @@ ffmpeg -y -f rawvideo -pix_fmt rgb24 -r 12 -s %dx%d -an -i -
             sec, subsec = divmod(frame_count, 12)
             if subsec == 0 and sec % 5 == 0:
                 print("%d:%02d" % (sec // 60, sec % 60))
-            blk_colorpairs, blk_shapes = ccc_unpack_frame(frame)
-            out = ccc_restore_frame(video_size[0], palim,
-                                    blk_colorpairs, blk_shapes)
-            out = out.resize(out_size, Image.Resampling.NEAREST).convert("RGB")
+            out = expand(ccc_restore_indices(video_size[0],
+                                             ccc_unpack_frame(frame)))
             if args.trace_frame and frame_count == args.trace_frame[0]:
+                out_im = Image.frombytes("RGB", out_size, bytes(out))
                 if args.trace_frame[1]:
-                    out.save(args.trace_frame[1])
+                    out_im.save(args.trace_frame[1])
                 else:
-                    out.show()
-            dst.stdin.write(out.tobytes())
+                    out_im.show()
+            dst.stdin.write(out)
             frame_count += 1
     result = dst.communicate()
 
@@ -0,0 +1,282 @@
+"""
+Entropy coding back end for Color Cell Compression experiments
+
+A frame is coded as one bit stream using three static canonical
+Huffman codes, each built from the whole video's symbol counts:
+
+- Change bitmap, one bit per block packed MSB first into bytes,
+  with each byte coded as a symbol (inter frames only)
+- Color pair, the byte as stored in uncompressed CCC
+- Shape, an index into a codebook of the most common shapes, or an
+  escape symbol followed by the 16-bit shape
+
+A block whose color nibbles are equal is solid and has no shape, as
+is a block whose shape is all 0 or all 1 bits.
+Before coding, each block is normalized so that its top left pixel
+uses the first color, swapping the colors and inverting the shape if
+needed.  This folds each shape together with its complement.
+
+Codes are limited to MAX_CODE_LENGTH bits so that a decoder can read
+that many bits and look up the symbol and its length in one table
+of 2**MAX_CODE_LENGTH entries, without walking a tree bit by bit.
+
+Copyright 2025 Damian Yerrick
+SPDX-License-Identifier: Zlib
+"""
+import heapq
+from collections import Counter
+from cccframe import CCCFrame
+
+MAX_CODE_LENGTH = 12
+CODEBOOK_SIZE = 256
+SHAPE_ESCAPE = CODEBOOK_SIZE
+
+def normalize_block(color, shape):
+    """Make the top left pixel of a block use the first color.
+
+color -- color pair byte, first color in the high nibble
+shape -- 16-bit shape, top left pixel in bit 15
+
+A block whose shape uses only one of its colors is made solid in
+that color, as the decoder reads a shape only when the nibbles differ.
+
+Return a 2-tuple (color, shape).
+"""
+    if (color >> 4) == (color & 0x0F):
+        return color, 0
+    if shape == 0:
+        return (color >> 4) * 0x11, 0
+    if shape == 0xFFFF:
+        return (color & 0x0F) * 0x11, 0
+    if shape & 0x8000:
+        return ((color << 4) & 0xF0) | (color >> 4), shape ^ 0xFFFF
+    return color, shape
+
+def huffman_code_lengths(counts, max_length=MAX_CODE_LENGTH):
+    """Calculate code lengths of a length-limited Huffman code.
+
+counts -- a sequence of how often each symbol occurs
+max_length -- longest allowed code in bits
+
+Return a list of code lengths in bits, with 0 for symbols whose
+count is 0.
+"""
+    lengths = [0] * len(counts)
+    used = [(count, sym) for sym, count in enumerate(counts) if count]
+    if not used: return lengths
+    if len(used) == 1:
+        lengths[used[0][1]] = 1
+        return lengths
+    if len(used) > 1 << max_length:
+        raise ValueError("%d symbols do not fit in %d-bit codes"
+                         % (len(used), max_length))
+
+    heap = [(count, i, [sym]) for i, (count, sym) in enumerate(used)]
+    heapq.heapify(heap)
+    tiebreak = len(heap)
+    while len(heap) > 1:
+        count0, _, syms0 = heapq.heappop(heap)
+        count1, _, syms1 = heapq.heappop(heap)
+        for sym in syms0: lengths[sym] += 1
+        for sym in syms1: lengths[sym] += 1
+        heapq.heappush(heap, (count0 + count1, tiebreak, syms0 + syms1))
+        tiebreak += 1
+
+    longest = max(lengths)
+    if longest <= max_length: return lengths
+
+    # Shorten the longest codes as in JPEG (ITU T.81 Annex K.3):
+    # take two codes from the longest length, move one of them up a
+    # level, and split a shorter code to make room for the other
+    bl_count = [0] * (longest + 1)
+    for length in lengths: bl_count[length] += 1
+    bl_count[0] = 0
+    for i in range(longest, max_length, -1):
+        while bl_count[i] > 0:
+            j = i - 2
+            while bl_count[j] == 0: j -= 1
+            bl_count[i] -= 2
+            bl_count[i - 1] += 1
+            bl_count[j + 1] += 2
+            bl_count[j] -= 1
+
+    # Give the shortest codes to the most common symbols
+    used.sort(key=lambda x: (-x[0], x[1]))
+    used_syms = iter(sym for count, sym in used)
+    for length in range(1, max_length + 1):
+        for _ in range(bl_count[length]):
+            lengths[next(used_syms)] = length
+    return lengths
+
+def canonical_codes(lengths):
+    """Assign canonical Huffman codes to symbols.
+
+Shorter codes precede longer codes, and codes of the same length are
+in symbol order.
+
+Return a list of codes as strings of "0" and "1", with "" for
+unused symbols.
+"""
+    codes = [""] * len(lengths)
+    code = prev_length = 0
+    for length, sym in sorted((l, s) for s, l in enumerate(lengths) if l):
+        code <<= length - prev_length
+        codes[sym] = format(code, "0%db" % length)
+        code += 1
+        prev_length = length
+    return codes
+
+def build_decode_table(lengths, max_length=MAX_CODE_LENGTH):
+    """Make a lookup table for decoding a canonical Huffman code.
+
+Return a list of 2**max_length (symbol, length) tuples indexed by
+the next max_length bits of the stream.  A 68000 or ARM decoder
+would store each entry as a 16-bit word.
+"""
+    table = [(0, 0)] * (1 << max_length)
+    for sym, code in enumerate(canonical_codes(lengths)):
+        if not code: continue
+        pad = max_length - len(code)
+        start = int(code, 2) << pad
+        table[start:start + (1 << pad)] = [(sym, len(code))] * (1 << pad)
+    return table
+
+def bits_to_bytes(bits):
+    """Pack a string of "0" and "1" into bytes, padding with 0 bits."""
+    bits += "0" * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, "big") if bits else b""
+
+def entropy_build_tables(frames, codebook_size=CODEBOOK_SIZE,
+                         max_length=MAX_CODE_LENGTH):
+    """Count symbols in a video and build codes for them.
+
+frames -- an iterable of (bitmap, blocks) tuples, where bitmap is a
+    change bitmap as bytes or None for an intra frame, and blocks is
+    a CCCFrame of the blocks coded in that frame
+
+Return a dict with these keys:
+- "codebook": list of the most common non-solid normalized shapes
+- "bitmap", "colors", "shapes": lists of code lengths
+"""
+    bitmap_counts = [0] * 256
+    color_counts = [0] * 256
+    shape_counts = Counter()
+    for bitmap, blocks in frames:
+        if bitmap is not None:
+            for c in bitmap: bitmap_counts[c] += 1
+        for color, shape in blocks:
+            color, shape = normalize_block(color, shape)
+            color_counts[color] += 1
+            if shape: shape_counts[shape] += 1
+    codebook = [shape for shape, count
+                in shape_counts.most_common(codebook_size)]
+    index_counts = [shape_counts[shape] for shape in codebook]
+    index_counts.extend([0] * (codebook_size - len(index_counts)))
+    index_counts.append(sum(shape_counts.values()) - sum(index_counts))
+    return {
+        "codebook": codebook,
+        "bitmap": huffman_code_lengths(bitmap_counts, max_length),
+        "colors": huffman_code_lengths(color_counts, max_length),
+        "shapes": huffman_code_lengths(index_counts, max_length),
+    }
+
+def entropy_tables_size(tables):
+    """Count bytes needed to store tables in a file header.
+
+Each code length is stored as a 4-bit nibble and each codebook shape
+as 2 bytes.
+"""
+    return (2 * len(tables["codebook"])
+            + sum(-(-len(tables[k]) // 2)
+                  for k in ("bitmap", "colors", "shapes")))
+
+def entropy_frame_codes(tables):
+    """Look up code strings for entropy_encode_frame().
+
+tables -- result of entropy_build_tables()
+"""
+    return (
+        canonical_codes(tables["bitmap"]),
+        canonical_codes(tables["colors"]),
+        canonical_codes(tables["shapes"]),
+        {shape: i for i, shape in enumerate(tables["codebook"])},
+    )
+
+def entropy_encode_frame(bitmap, blocks, codes):
+    """Code one frame.
+
+bitmap -- change bitmap bytes, or None for an intra frame
+blocks -- CCCFrame of the blocks coded in this frame
+codes -- result of entropy_frame_codes()
+
+Return a 2-tuple (data, bit_counts) where data is the coded frame
+padded to a whole byte and bit_counts is a dict of how many bits
+each of "bitmap", "colors", and "shapes" used.
+"""
+    bitmap_codes, color_codes, shape_codes, shape_index = codes
+    bitmap_bits = ("".join(bitmap_codes[c] for c in bitmap)
+                   if bitmap is not None else "")
+    out = [bitmap_bits]
+    color_bits = shape_bits = 0
+    for color, shape in blocks:
+        color, shape = normalize_block(color, shape)
+        code = color_codes[color]
+        out.append(code)
+        color_bits += len(code)
+        if not shape: continue
+        index = shape_index.get(shape)
+        if index is None:
+            code = shape_codes[SHAPE_ESCAPE] + format(shape, "016b")
+        else:
+            code = shape_codes[index]
+        out.append(code)
+        shape_bits += len(code)
+    bit_counts = {"bitmap": len(bitmap_bits),
+                  "colors": color_bits, "shapes": shape_bits}
+    return bits_to_bytes("".join(out)), bit_counts
+
+def entropy_decode_frame(data, tables, num_blocks, inter,
+                         max_length=MAX_CODE_LENGTH):
+    """Decode one frame using table lookups.
+
+data -- the coded frame
+tables -- result of entropy_build_tables()
+num_blocks -- number of blocks in a whole frame
+inter -- true if the frame begins with a change bitmap
+
+Return a 2-tuple (bitmap, blocks) like an item passed to
+entropy_build_tables(), except that blocks are normalized.
+"""
+    bits = "".join(format(c, "08b") for c in data) + "0" * max_length
+    pos = 0
+    def decode_symbol(table):
+        nonlocal pos
+        sym, length = table[int(bits[pos:pos + max_length], 2)]
+        if not length: raise ValueError("invalid code at bit %d" % pos)
+        pos += length
+        return sym
+
+    if inter:
+        table = build_decode_table(tables["bitmap"], max_length)
+        bitmap = bytes(decode_symbol(table)
+                       for i in range(-(-num_blocks // 8)))
+        num_coded = sum(bin(c).count("1") for c in bitmap)
+    else:
+        bitmap, num_coded = None, num_blocks
+    color_table = build_decode_table(tables["colors"], max_length)
+    shape_table = build_decode_table(tables["shapes"], max_length)
+    codebook = tables["codebook"]
+    out = CCCFrame()
+    for i in range(num_coded):
+        color = decode_symbol(color_table)
+        shape = 0
+        if (color >> 4) != (color & 0x0F):
+            index = decode_symbol(shape_table)
+            if index == SHAPE_ESCAPE:
+                shape = int(bits[pos:pos + 16], 2)
+                pos += 16
+            else:
+                shape = codebook[index]
+        out.colors.append(color)
+        out.shapes.append(shape)
+    return bitmap, out
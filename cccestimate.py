@@ -12,15 +12,18 @@ SPDX-License-Identifier: Zlib
 """
 import os, sys, argparse
 from collections import Counter
-from itertools import zip_longest
 from time import sleep
 from math import sqrt
-import cccdec
+from cccframe import CCCFrame, HEADER_SIZE, CCC_SIZE, unpack_header
+from cccentropy import (entropy_build_tables, entropy_frame_codes,
+                        entropy_encode_frame, entropy_tables_size)
+from cccinter import (change_mask, encode_change_rows, motion_search,
+                      motion_predict, encode_vectors)
 
 def try_intra(frame, omit_full_matches=False):
     """Count how often each 4x4-pixel shape is used in a frame.
 
-frame --  byteslike alternating color, shape top, shape bottom
+frame -- a CCCFrame
 omit_full_matches -- if true, all_shapes shall not include
     items included in full_matches
 
@@ -34,9 +37,7 @@ Return a 3-tuple (all_shapes, full_matches, color_only_matches) where
     all_shapes = Counter()
     last_color = last_shape = None
     color_only_matches = full_matches = 0
-    for i in range(0, len(frame), 3):
-        color = frame[i]
-        shape = frame[i + 1] << 8 | frame[i + 2]
+    for color, shape in frame:
         if not (omit_full_matches and color == last_color
                 and shape == last_shape):
             all_shapes[shape] += 1
@@ -49,10 +50,37 @@ Return a 3-tuple (all_shapes, full_matches, color_only_matches) where
     return all_shapes, full_matches, color_only_matches
 
 def try_inter(frame, prev_frame):
-    this_blocks = [frame[i:i + 3] for i in range(0, len(frame), 3)]
-    prev_blocks = [prev_frame[i:i + 3] for i in range(0, len(prev_frame), 3)]
-    found = [t for t, p in zip_longest(this_blocks, prev_blocks) if t != p]
-    return b"".join(found)
+    """Make a CCCFrame of only blocks that differ from the previous frame."""
+    return frame.select([i for i, (t, p) in enumerate(zip(frame, prev_frame))
+                         if t != p])
+
+def change_bitmap(frame, prev_frame):
+    """Find which blocks differ from the previous frame.
+
+Return one bit per block packed into bytes, most significant bit
+first, with 1 for blocks that differ.
+"""
+    bitmap = bytearray(-(-len(frame) // 8))
+    for i, (t, p) in enumerate(zip(frame, prev_frame)):
+        if t != p:
+            bitmap[i // 8] |= 0x80 >> (i % 8)
+    return bytes(bitmap)
+
+def print_common_shapes(common, show_totals=True):
+    """Print a table of common shapes.
+
+common - an array of [(shape, count, *otherfields), ...]
+show_totals - if true, also print how often the top 15 shapes and
+    the rest are used
+"""
+    print("\n".join(
+        "{0:02x} {1:016b} {2:6d}".format(y, row[0], row[1])
+        for y, row in enumerate(common)
+    ))
+    if show_totals:
+        print("top 15: %d; non-top 15: %d"
+              % (sum(row[1] for row in common[:15]),
+                 sum(row[1] for row in common[15:])))
 
 def plot_common_usage(frame_shapes, common,
                       print_common=True, centroid_sort=False):
@@ -85,14 +113,7 @@ Return a Pillow image
         common.sort(key=lambda x: centroids[x[0]])
 
     if print_common:
-        print("\n".join(
-            "{0:02x} {1:016b} {2:6d}".format(y, row[0], row[1])
-            for y, row in enumerate(common)
-        ))
-        if not centroid_sort:
-            print("top 15: %d; non-top 15: %d"
-                  % (sum(row[1] for row in common[:15]),
-                     sum(row[1] for row in common[15:])))
+        print_common_shapes(common, show_totals=not centroid_sort)
 
     # draw patterns to left side of row
     # don't draw last row if common length not multiple of 4
@@ -116,43 +137,315 @@ Return a Pillow image
     im.putdata(b"".join(counts))
     return im
 
+def print_entropy_sizes(coded_frames, frame_count, byte_sizes, fps=12,
+                        map_bits=None):
+    """Huffman code a video and compare to the byte-aligned estimate.
+
+coded_frames -- [(bitmap or None, CCCFrame of coded blocks), ...]
+byte_sizes -- byte-aligned estimate of bitmap, color pair, shape,
+    and table sizes in bytes, where the bitmap is 1 bit per block
+    plus any motion vectors
+map_bits -- for inter frames, [(vector bits, row-coded bitmap bits),
+    ...] with one entry per frame
+
+Inter frames code the change bitmap either with the bitmap's Huffman
+code or with the row coding of encode_change_rows(), whichever makes
+the whole video smaller.  Motion vectors precede either one.  With
+the row coding, the bitmap's code lengths are not stored.
+"""
+    tables = entropy_build_tables(coded_frames)
+    codes = entropy_frame_codes(tables)
+    bits = Counter()
+    huffman_bytes = rows_bytes = vector_bits = rows_bits = 0
+    for i, (bitmap, blocks) in enumerate(coded_frames):
+        data, bit_counts = entropy_encode_frame(bitmap, blocks, codes)
+        bits.update(bit_counts)
+        frame_vector_bits, frame_rows_bits = (map_bits[i] if map_bits
+                                              else (0, 0))
+        vector_bits += frame_vector_bits
+        rows_bits += frame_rows_bits
+        blocks_bits = bit_counts["colors"] + bit_counts["shapes"]
+        huffman_bytes += -(-(frame_vector_bits + bit_counts["bitmap"]
+                             + blocks_bits) // 8)
+        rows_bytes += -(-(frame_vector_bits + frame_rows_bits
+                          + blocks_bits) // 8)
+    tables_bytes = entropy_tables_size(tables)
+    bitmap_table_bytes = -(-len(tables["bitmap"]) // 2)
+    use_rows = map_bits and rows_bytes < huffman_bytes + bitmap_table_bytes
+    if use_rows:
+        tables_bytes -= bitmap_table_bytes
+        map_name, coded_bytes = "row-coded", rows_bytes
+        map_bytes = -(-(vector_bits + rows_bits) // 8)
+    else:
+        map_name, coded_bytes = "Huffman coded", huffman_bytes
+        map_bytes = -(-(vector_bits + bits["bitmap"]) // 8)
+    entropy_sizes = [
+        map_bytes, -(-bits["colors"] // 8),
+        -(-bits["shapes"] // 8), tables_bytes,
+    ]
+    total_bytes = coded_bytes + tables_bytes
+    print("\nHuffman coded (lengths up to %d bits, frames byte aligned)"
+          % max(max(tables[k]) for k in ("bitmap", "colors", "shapes")))
+    if map_bits:
+        print("change bitmap %s (flat %d, Huffman coded %d, "
+              "row-coded %d bytes)"
+              % (map_name, byte_sizes[0],
+                 -(-(vector_bits + bits["bitmap"]) // 8),
+                 -(-(vector_bits + rows_bits) // 8)))
+    print("          byte-aligned  Huffman coded")
+    for name, before, after in zip(
+        ("bitmap", "colors", "shapes", "tables"), byte_sizes, entropy_sizes
+    ):
+        print("%-8s%14d%15d" % (name, before, after))
+    before = sum(byte_sizes)
+    print("%-8s%14d%15d" % ("total", before, total_bytes))
+    seconds = frame_count / fps
+    if seconds:
+        print("%-8s%14.0f%15.0f" % ("bytes/s", before / seconds,
+                                     total_bytes / seconds))
+
+CORPUS_BUCKETS = 16
+CORPUS_CHUNK_FRAMES = 64
+
+def corpus_count_file(task, chunk_frames=CORPUS_CHUNK_FRAMES):
+    """Count shape usage in one CCC file for corpus mode.
+
+task -- a tuple (filename, num_buckets, inter) where inter is true
+    to skip blocks identical to the previous frame
+chunk_frames -- number of frames to read at once, which bounds
+    memory use regardless of the video's length
+
+Frames are divided into num_buckets equal spans of the video's
+running time, so that videos of any length can be added together.
+Blocks are normalized as in cccentropy.normalize_block(), so that
+each shape is counted together with its complement and no counted
+shape has bit 15 set.
+
+Return a tuple (filename, frame_count, histogram, usage,
+bucket_frames) where histogram is a numpy array counting each of the
+65536 shapes, usage is a (num_buckets, 65536) array counting them in
+each bucket, and bucket_frames counts frames in each bucket.
+
+Raise ValueError if the file is not a CCC file.
+"""
+    import numpy as np
+
+    filename, num_buckets, inter = task
+    usage = np.zeros((num_buckets, 65536), dtype=np.int64)
+    bucket_frames = np.zeros(num_buckets, dtype=np.int64)
+    with open(filename, "rb") as infp:
+        header = infp.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError("header is %d bytes, expected %d"
+                             % (len(header), HEADER_SIZE))
+        video_size, palette = unpack_header(header)
+        num_blocks = ((video_size[0] // CCC_SIZE[0])
+                      * (video_size[1] // CCC_SIZE[1]))
+        if not num_blocks:
+            raise ValueError("video size %dx%d has no blocks" % video_size)
+        frame_bytes = num_blocks * 3
+        frame_count = ((os.fstat(infp.fileno()).st_size - HEADER_SIZE)
+                       // frame_bytes)
+        prev_colors = np.zeros(num_blocks, dtype=np.uint8)
+        prev_shapes = np.zeros(num_blocks, dtype=np.uint16)
+        for b in range(num_buckets):
+            start = frame_count * b // num_buckets
+            end = frame_count * (b + 1) // num_buckets
+            for chunk_start in range(start, end, chunk_frames):
+                num_frames = min(chunk_frames, end - chunk_start)
+                data = infp.read(num_frames * frame_bytes)
+                if len(data) < num_frames * frame_bytes:
+                    raise ValueError("file ended early at frame %d"
+                                     % chunk_start)
+                chunk = CCCFrame.from_bytes(data)
+                colors = np.frombuffer(chunk.colors, dtype=np.uint8)
+                shapes = np.frombuffer(chunk.shapes, dtype=np.uint16)
+                if inter:
+                    colors = colors.reshape(num_frames, num_blocks)
+                    shapes = shapes.reshape(num_frames, num_blocks)
+                    changed = np.empty(colors.shape, dtype=bool)
+                    changed[0] = ((colors[0] != prev_colors)
+                                  | (shapes[0] != prev_shapes))
+                    changed[1:] = ((colors[1:] != colors[:-1])
+                                   | (shapes[1:] != shapes[:-1]))
+                    prev_colors, prev_shapes = colors[-1], shapes[-1]
+                    colors, shapes = colors[changed], shapes[changed]
+                shapes = np.where(shapes & 0x8000, shapes ^ 0xFFFF, shapes)
+                shapes[(colors >> 4) == (colors & 0x0F)] = 0
+                usage[b] += np.bincount(shapes, minlength=65536)
+            bucket_frames[b] = end - start
+    return filename, frame_count, usage.sum(axis=0), usage, bucket_frames
+
+def corpus_count_task(task):
+    """Call corpus_count_file() in a worker process.
+
+A worker that raises an exception ends the whole pool, so return
+a 2-tuple (result, error) instead, where error is None on success
+or a message naming the file.
+"""
+    try:
+        return corpus_count_file(task), None
+    except (OSError, ValueError) as e:
+        return None, "%s: %s" % (task[0], e)
+
+def corpus_main(args):
+    """Count shape usage across many CCC files in worker processes."""
+    import numpy as np
+    from multiprocessing import Pool
+
+    tasks = [(filename, args.buckets, args.inter)
+             for filename in args.input]
+    histogram = np.zeros(65536, dtype=np.int64)
+    usage = np.zeros((args.buckets, 65536), dtype=np.int64)
+    bucket_frames = np.zeros(args.buckets, dtype=np.int64)
+    total_frames = num_files = 0
+    with Pool(args.jobs) as pool:
+        for result, error in pool.imap_unordered(corpus_count_task, tasks):
+            if error:
+                print("cccestimate.py: skipping", error, file=sys.stderr)
+                continue
+            filename, frame_count, file_hist, file_usage, file_frames = result
+            print("%s: %d frames, %d blocks counted"
+                  % (filename, frame_count, file_hist.sum()))
+            histogram += file_hist
+            usage += file_usage
+            bucket_frames += file_frames
+            total_frames += frame_count
+            num_files += 1
+
+    total_blocks = int(histogram.sum())
+    print("%d files, %d frames, %d blocks counted"
+          % (num_files, total_frames, total_blocks))
+    if num_files < len(tasks):
+        print("%d files skipped" % (len(tasks) - num_files))
+    if not total_blocks: return
+    print("solid: %d (%.1f%%)"
+          % (histogram[0], 100 * histogram[0] / total_blocks))
+
+    # Rank non-solid shapes, breaking ties by shape
+    ranked = np.lexsort((np.arange(65536), -histogram))
+    ranked = [int(shape) for shape in ranked
+              if shape and histogram[shape]][:args.top]
+    common = [(shape, int(histogram[shape])) for shape in ranked]
+    if args.codebook:
+        with open(args.codebook, "wb") as outfp:
+            outfp.write(b"".join(shape.to_bytes(2, "big")
+                                 for shape, count in common))
+    if args.usage_image:
+        # Average uses per frame in each bucket
+        bucket_shapes = [
+            {shape: usage[b, shape] / max(1, bucket_frames[b])
+             for shape, count in common}
+            for b in range(args.buckets)
+        ]
+        common_im = plot_common_usage(bucket_shapes, common)
+        common_im.save(args.usage_image)
+    else:
+        print_common_shapes(common)
+
 def parse_argv(argv):
     p = argparse.ArgumentParser(
         description="Estimates how big the compressed CCC file would be"
     )
-    p.add_argument("input", help="video file produced by ccc.py")
+    p.add_argument("input", nargs="+",
+                   help="video file produced by ccc.py, or several "
+                        "in corpus mode")
     p.add_argument("--inter", action="store_true",
                    help="skip blocks matching a block in the previous frame")
-    return p.parse_args(argv[1:])
+    p.add_argument("--motion", action="store_true",
+                   help="with --inter, also copy regions of blocks "
+                        "from a shifted position in the previous frame")
+    p.add_argument("--entropy", action="store_true",
+                   help="also Huffman code the bitmap, color pairs, "
+                        "and shapes and report coded sizes")
+    p.add_argument("--usage-image", metavar="PNGFILE",
+                   help="draw how often common shapes are used in each "
+                        "frame, such as common_shapes_usage.png "
+                        "(requires Pillow)")
+    p.add_argument("--corpus", action="store_true",
+                   help="count shape usage in all inputs in parallel "
+                        "and rank shapes for a shared codebook "
+                        "(default if more than one input; requires numpy)")
+    p.add_argument("-j", "--jobs", type=int,
+                   help="number of worker processes in corpus mode "
+                        "(default: number of CPUs)")
+    p.add_argument("--buckets", type=int, default=CORPUS_BUCKETS,
+                   help="number of spans into which corpus mode divides "
+                        "each video's running time (default %d)"
+                        % CORPUS_BUCKETS)
+    p.add_argument("--top", type=int, default=256,
+                   help="number of shapes to rank in corpus mode "
+                        "(default 256)")
+    p.add_argument("--codebook", metavar="BINFILE",
+                   help="in corpus mode, write ranked shapes as "
+                        "big-endian 16-bit words")
+    args = p.parse_args(argv[1:])
+    if args.jobs is not None and args.jobs < 1:
+        p.error("--jobs must be at least 1")
+    if args.buckets < 1:
+        p.error("--buckets must be at least 1")
+    if len(args.input) > 1: args.corpus = True
+    if args.corpus and (args.entropy or args.motion):
+        p.error("--entropy and --motion need a single input")
+    if args.codebook and not args.corpus:
+        p.error("--codebook needs corpus mode")
+    return args
 
 def main(argv=None):
     args = parse_argv(argv or sys.argv)
-    use_interframe = args.inter
-    
-    with open(args.input, "rb") as infp:
-        header = infp.read(cccdec.HEADER_SIZE)
-        video_size, palim = cccdec.ccc_unpack_header(header)
-        small_size = (video_size[0] // cccdec.CCC_SIZE[0],
-                      video_size[1] // cccdec.CCC_SIZE[1])
+    if args.corpus:
+        corpus_main(args)
+        return
+    use_interframe = args.inter or args.motion
+    filename = args.input[0]
+
+    with open(filename, "rb") as infp:
+        header = infp.read(HEADER_SIZE)
+        video_size, palette = unpack_header(header)
+        small_size = (video_size[0] // CCC_SIZE[0],
+                      video_size[1] // CCC_SIZE[1])
         frame_bytes = small_size[0] * small_size[1] * 3
         print("%s: %dx%d pixels, %dx%d blocks, %d bytes/frame"
-              % (args.input, *video_size, *small_size, frame_bytes))
+              % (filename, *video_size, *small_size, frame_bytes))
         frame_count = 0
         all_shapes = Counter()
         frame_shapes = []
-        prev_frame = bytes(frame_bytes)
-        total_inter_bytes = 0
+        prev_frame = CCCFrame.zeros(small_size[0] * small_size[1])
+        total_inter_blocks = 0
+        inter_map_size = motion_bits = 0
         intra_color_matches = intra_full_matches = 0
+        coded_frames = []
+        frame_map_bits = []
         while True:
             frame = infp.read(frame_bytes)
             if len(frame) < frame_bytes: break
+            frame = CCCFrame.from_bytes(frame)
             if use_interframe:
+                frame_motion_bits = ""
+                if args.motion:
+                    vectors = motion_search(frame, prev_frame, small_size[0])
+                    frame_motion_bits = encode_vectors(vectors)
+                    prev_frame = motion_predict(prev_frame, small_size[0],
+                                                vectors)
                 inter_result = try_inter(frame, prev_frame)
+                map_bits = encode_change_rows(change_mask(frame, prev_frame),
+                                              small_size[0])
+                motion_bits += len(frame_motion_bits)
+                inter_map_size += -(-(len(frame_motion_bits)
+                                      + len(map_bits)) // 8)
             else:
                 inter_result = frame
-            total_inter_bytes += len(inter_result)
+            total_inter_blocks += len(inter_result)
+            if args.entropy:
+                bitmap = None
+                if use_interframe:
+                    bitmap = change_bitmap(frame, prev_frame)
+                    frame_map_bits.append((len(frame_motion_bits),
+                                           len(map_bits)))
+                coded_frames.append((bitmap, inter_result))
             intra_result = try_intra(inter_result)
-            frame_shapes.append(intra_result[0])
+            if args.usage_image:
+                frame_shapes.append(intra_result[0])
             all_shapes += intra_result[0]
             intra_full_matches += intra_result[1]
             intra_color_matches += intra_result[2]
@@ -160,20 +453,22 @@ def main(argv=None):
             prev_frame = frame
     num_blocks = small_size[0] * small_size[1] * frame_count
     before_bytes = 3 * num_blocks
-    inter_blocks = total_inter_bytes // 3
+    inter_blocks = total_inter_blocks
     common = [row for row in all_shapes.most_common(257) if row[0]]
     del common[256:]
     # common is [(shape, count), ...]
     total_common = sum(row[1] for row in common)
     total_full = inter_blocks - all_shapes[0] - total_common
     if use_interframe:
-        inter_map_size = frame_count * frame_bytes // 24
-        print("with interframe coding")
+        print("with interframe coding"
+              + (" and motion" if args.motion else ""))
     else:
-        inter_map_size = 0
         print("intra coding only!")
-    common_im = plot_common_usage(frame_shapes, common)
-    common_im.save("common_shapes_usage.png")
+    if args.usage_image:
+        common_im = plot_common_usage(frame_shapes, common)
+        common_im.save(args.usage_image)
+    else:
+        print_common_shapes(common)
     print("block bitmap")
     print("of %d blocks:\n"
           "  %d inter elided, %d full match, %d color match, %d none"
@@ -185,6 +480,11 @@ def main(argv=None):
           % ((num_blocks - inter_blocks),
              (num_blocks - inter_blocks) * 100 / num_blocks,
              inter_map_size))
+    if use_interframe:
+        print("  (flat bitmap %d bytes; row-coded bitmap and vectors"
+              " %d bytes, of which vectors %d bytes)"
+              % (frame_count * frame_bytes // 24, inter_map_size,
+                 -(-motion_bits // 8)))
     print("solid: %7d (%4.1f%%),%8d bytes"
           % (all_shapes[0], 100 * all_shapes[0] / num_blocks, all_shapes[0]))
     print("common:%7d (%4.1f%%),%8d bytes"
@@ -198,13 +498,23 @@ def main(argv=None):
     )
     print("total: %7d (100.%%),%8d bytes" % (num_blocks, total_bytes))
     print("saved %.1f%%" % ((before_bytes - total_bytes) * 100 / before_bytes))
+    if args.entropy:
+        flat_map_size = (frame_count * frame_bytes // 24
+                         + -(-motion_bits // 8) if use_interframe else 0)
+        print_entropy_sizes(coded_frames, frame_count, (
+            flat_map_size, inter_blocks, total_common + 2 * total_full, 512
+        ), map_bits=frame_map_bits)
 
     print("""
 Assumed coding scheme
 
 - If interframe is enabled, each frame is preceded by a bitfield with
   one bit per 4x4-pixel block.  Blocks with the bit clear are treated
-  as identical to the previous frame.
+  as identical to the previous frame.  Rows without changes are
+  skipped, and other rows are stored as bits or run lengths,
+  whichever is smaller (see cccinter.py).
+- With motion, the previous frame is shifted by whole blocks in each
+  32x32-pixel region before comparing, to follow pans.
 - Maybe expand the bitfield to indicate matching the previous block
   either in color or in color and shape
 - Each coded block starts with a 1-byte pair of color values.
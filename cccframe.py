@@ -0,0 +1,92 @@
+"""
+Compact representation of one Color Cell Compression frame
+
+Copyright 2025 Damian Yerrick
+SPDX-License-Identifier: Zlib
+"""
+import sys, struct
+from array import array
+
+HEADER_SIZE = 52
+CCC_SIZE = (4, 4)
+BLOCK_BYTES = 3
+
+def unpack_header(header):
+    """Read a CCC file header without loading Pillow.
+
+Return a 2-tuple ((width, height), palette) where palette is 48
+bytes of 16 RGB colors.
+"""
+    return struct.unpack(">HH", header[0:4]), header[4:HEADER_SIZE]
+
+class CCCFrame:
+    """Color pairs and shapes of a frame's blocks in two packed arrays.
+
+colors -- array('B') of color pairs, with the color of 0 bits in the
+    high nibble and the color of 1 bits in the low nibble
+shapes -- array('H') of shapes, with the top left pixel in bit 15
+    and the bottom right pixel in bit 0
+
+A solid block has both nibbles the same and shape 0.
+
+Iterating over a frame yields (color, shape) tuples.
+"""
+    __slots__ = ("colors", "shapes")
+
+    def __init__(self, colors=None, shapes=None):
+        self.colors = array("B") if colors is None else colors
+        self.shapes = array("H") if shapes is None else shapes
+        if len(self.colors) != len(self.shapes):
+            raise ValueError("%d color pairs but %d shapes"
+                             % (len(self.colors), len(self.shapes)))
+
+    @classmethod
+    def zeros(cls, num_blocks):
+        """Make a frame of solid blocks of color 0."""
+        return cls(array("B", bytes(num_blocks)),
+                   array("H", bytes(2 * num_blocks)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Read blocks stored as a color pair byte and a big-endian shape."""
+        if len(data) % BLOCK_BYTES:
+            raise ValueError("frame length %d not a multiple of %d"
+                             % (len(data), BLOCK_BYTES))
+        shape_data = bytearray(len(data) // BLOCK_BYTES * 2)
+        shape_data[0::2] = data[1::3]
+        shape_data[1::2] = data[2::3]
+        shapes = array("H", shape_data)
+        if sys.byteorder == "little": shapes.byteswap()
+        return cls(array("B", data[0::3]), shapes)
+
+    def to_bytes(self):
+        """Write blocks as a color pair byte and a big-endian shape."""
+        shapes = array("H", self.shapes)
+        if sys.byteorder == "little": shapes.byteswap()
+        shape_data = shapes.tobytes()
+        out = bytearray(len(self.colors) * BLOCK_BYTES)
+        out[0::3] = self.colors
+        out[1::3] = shape_data[0::2]
+        out[2::3] = shape_data[1::2]
+        return bytes(out)
+
+    def copy(self):
+        return CCCFrame(array("B", self.colors), array("H", self.shapes))
+
+    def select(self, indices):
+        """Make a frame of only the blocks at the given indices."""
+        return CCCFrame(array("B", [self.colors[i] for i in indices]),
+                        array("H", [self.shapes[i] for i in indices]))
+
+    def __len__(self):
+        return len(self.colors)
+
+    def __iter__(self):
+        return zip(self.colors, self.shapes)
+
+    def __eq__(self, other):
+        if not isinstance(other, CCCFrame): return NotImplemented
+        return self.colors == other.colors and self.shapes == other.shapes
+
+    def __repr__(self):
+        return "<CCCFrame of %d blocks>" % len(self)
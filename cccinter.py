@@ -0,0 +1,223 @@
+"""
+Inter-frame coding for Color Cell Compression experiments
+
+Each inter frame begins with optional motion vectors followed by a
+change bitmap saying which blocks are coded and which are copied
+from the prediction.  The prediction is the previous frame, with
+each region optionally copied from a position shifted by a whole
+number of blocks, which handles pans.  A decoder can copy blocks
+without decoding them, so vectors are in blocks rather than pixels.
+
+Motion vectors:
+
+- 1 bit: 1 if any region has a vector
+- If so, for each region in row-major order, 1 bit: 1 if the region
+  has a vector, followed by 3-bit two's complement x and y offsets
+  of the source block from the destination block
+
+Change bitmap, for each row of blocks:
+
+- 1 bit: 1 if any block in the row is coded
+- If so, 1 bit: 0 for packed or 1 for run lengths
+- Packed: 1 bit for each block in the row, 1 if coded
+- Run lengths: alternating runs of copied and coded blocks, starting
+  with copied, until the row is full.  Each run's length is an
+  order-0 exponential Golomb code.  Only the first run can be empty,
+  so later runs store length minus 1.
+
+Copyright 2025 Damian Yerrick
+SPDX-License-Identifier: Zlib
+"""
+REGION_SIZE = (8, 8)
+MOTION_RANGE = 3
+MOTION_MIN_GAIN = 2
+VECTOR_BITS = 3
+
+def exp_golomb(value):
+    """Make an order-0 exponential Golomb code for an integer >= 0."""
+    code = format(value + 1, "b")
+    return "0" * (len(code) - 1) + code
+
+def read_exp_golomb(bits, pos):
+    """Read an order-0 exponential Golomb code.
+
+Return a 2-tuple (value, position after the code).
+"""
+    zeros = 0
+    while bits[pos + zeros] == "0": zeros += 1
+    end = pos + 2 * zeros + 1
+    return int(bits[pos + zeros:end], 2) - 1, end
+
+def change_mask(frame, pred_frame):
+    """Compare each block of a CCCFrame to a prediction.
+
+Return bytes with 1 for blocks that differ and 0 for blocks that
+match.
+"""
+    return bytes(t != p for t, p in zip(frame, pred_frame))
+
+def encode_change_rows(mask, width_blocks):
+    """Code a change mask with row skip flags and run lengths.
+
+mask -- one byte per block, 1 if coded, in row-major order
+width_blocks -- number of blocks in each row
+
+Return a string of "0" and "1".
+"""
+    out = []
+    for top in range(0, len(mask), width_blocks):
+        row = mask[top:top + width_blocks]
+        if not any(row):
+            out.append("0")
+            continue
+        packed = "".join("1" if c else "0" for c in row)
+        runs = []
+        run_value, run_length = 0, 1
+        for c in row:
+            if c != run_value:
+                runs.append(exp_golomb(run_length - 1))
+                run_value, run_length = c, 0
+            run_length += 1
+        runs.append(exp_golomb(run_length - 1))
+        runs = "".join(runs)
+        if len(runs) < len(packed):
+            out.append("11" + runs)
+        else:
+            out.append("10" + packed)
+    return "".join(out)
+
+def decode_change_rows(bits, pos, width_blocks, height_blocks):
+    """Decode a change mask coded by encode_change_rows().
+
+Return a 2-tuple (mask, position after the mask).
+"""
+    mask = bytearray()
+    for y in range(height_blocks):
+        if bits[pos] == "0":
+            mask.extend(bytes(width_blocks))
+            pos += 1
+            continue
+        is_runs = bits[pos + 1] == "1"
+        pos += 2
+        if not is_runs:
+            mask.extend(int(c) for c in bits[pos:pos + width_blocks])
+            pos += width_blocks
+            continue
+        run_value, run_extra, remain = 0, 0, width_blocks
+        while remain:
+            run_length, pos = read_exp_golomb(bits, pos)
+            run_length += run_extra
+            mask.extend([run_value] * run_length)
+            remain -= run_length
+            run_value, run_extra = 1 - run_value, 1
+    return bytes(mask), pos
+
+def region_bounds(width_blocks, height_blocks, region_size=REGION_SIZE):
+    """List each region's (left, top, right, bottom) in blocks."""
+    return [
+        (left, top, min(left + region_size[0], width_blocks),
+         min(top + region_size[1], height_blocks))
+        for top in range(0, height_blocks, region_size[1])
+        for left in range(0, width_blocks, region_size[0])
+    ]
+
+def motion_search(frame, prev_frame, width_blocks,
+                  region_size=REGION_SIZE, search_range=MOTION_RANGE,
+                  min_gain=MOTION_MIN_GAIN):
+    """Find the shift of each region that matches the most blocks.
+
+frame, prev_frame -- CCCFrame instances
+width_blocks -- number of blocks in each row
+min_gain -- a region keeps (0, 0) unless a shift matches at least
+    this many more blocks, to pay for coding the vector
+
+Blocks whose source would lie outside the frame do not match.
+
+Return a list of (dx, dy) tuples for regions in row-major order.
+"""
+    height_blocks = len(frame) // width_blocks
+    cur, prev = list(frame), list(prev_frame)
+    offsets = sorted(
+        ((dx, dy)
+         for dy in range(-search_range, search_range + 1)
+         for dx in range(-search_range, search_range + 1)),
+        key=lambda v: abs(v[0]) + abs(v[1])
+    )
+    vectors = []
+    for left, top, right, bottom in region_bounds(width_blocks, height_blocks,
+                                                  region_size):
+        best_vector, best_matches = (0, 0), None
+        for dx, dy in offsets:
+            x0, x1 = max(left, -dx), min(right, width_blocks - dx)
+            y0, y1 = max(top, -dy), min(bottom, height_blocks - dy)
+            matches = 0
+            for y in range(y0, y1):
+                row = y * width_blocks
+                src = row + dy * width_blocks + dx
+                matches += sum(
+                    a == b for a, b in zip(cur[row + x0:row + x1],
+                                           prev[src + x0:src + x1])
+                )
+            if best_matches is None:
+                # (0, 0) comes first
+                best_matches = matches + min_gain - 1
+            elif matches > best_matches:
+                best_vector, best_matches = (dx, dy), matches
+        vectors.append(best_vector)
+    return vectors
+
+def motion_predict(prev_frame, width_blocks, vectors,
+                   region_size=REGION_SIZE):
+    """Copy each region of the previous frame from a shifted position.
+
+Blocks whose source lies outside the frame are copied unshifted.
+
+Return the predicted frame as a CCCFrame.
+"""
+    height_blocks = len(prev_frame) // width_blocks
+    pred = prev_frame.copy()
+    for (left, top, right, bottom), (dx, dy) in zip(
+        region_bounds(width_blocks, height_blocks, region_size), vectors
+    ):
+        if not (dx or dy): continue
+        x0, x1 = max(left, -dx), min(right, width_blocks - dx)
+        y0, y1 = max(top, -dy), min(bottom, height_blocks - dy)
+        length = x1 - x0
+        for y in range(y0, y1):
+            dst = y * width_blocks + x0
+            src = (y + dy) * width_blocks + x0 + dx
+            pred.colors[dst:dst + length] = prev_frame.colors[src:src + length]
+            pred.shapes[dst:dst + length] = prev_frame.shapes[src:src + length]
+    return pred
+
+def encode_vectors(vectors):
+    """Code motion vectors as a string of "0" and "1"."""
+    if not any(dx or dy for dx, dy in vectors): return "0"
+    mask = (1 << VECTOR_BITS) - 1
+    return "1" + "".join(
+        "1%s%s" % (format(dx & mask, "0%db" % VECTOR_BITS),
+                   format(dy & mask, "0%db" % VECTOR_BITS))
+        if dx or dy else "0"
+        for dx, dy in vectors
+    )
+
+def decode_vectors(bits, pos, num_regions):
+    """Decode motion vectors coded by encode_vectors().
+
+Return a 2-tuple (vectors, position after the vectors).
+"""
+    if bits[pos] == "0": return [(0, 0)] * num_regions, pos + 1
+    pos += 1
+    sign = 1 << (VECTOR_BITS - 1)
+    vectors = []
+    for i in range(num_regions):
+        if bits[pos] == "0":
+            vectors.append((0, 0))
+            pos += 1
+            continue
+        pos += 1
+        dx = int(bits[pos:pos + VECTOR_BITS], 2)
+        dy = int(bits[pos + VECTOR_BITS:pos + 2 * VECTOR_BITS], 2)
+        vectors.append(((dx ^ sign) - sign, (dy ^ sign) - sign))
+        pos += 2 * VECTOR_BITS
+    return vectors, pos
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Regression and throughput tests for the Color Cell Compression tools
+
+Synthetic frames drawn from fixed seeds are encoded and decoded.
+Results are compared to golden hashes, to slow reference versions of
+the codec that keep one object per block or per pixel, and to
+minimum frame rates or minimum speedups over the reference versions.
+
+    python3 -m unittest ccctest
+    python3 ccctest.py --print-golden
+
+The second form prints the current hashes, for when the bitstream is
+changed on purpose.  Frame rate checks can be scaled down on a slow
+machine by setting CCCTEST_FPS_SCALE, such as to 0.5, or turned off
+by setting it to 0.
+
+Copyright 2025 Damian Yerrick
+SPDX-License-Identifier: Zlib
+"""
+import os, sys, unittest, hashlib, random, time, tempfile
+from array import array
+from collections import Counter
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+from operator import or_ as bitor
+from functools import reduce
+from PIL import Image, ImageChops, ImageDraw
+import ccc, cccdec, cccentropy, cccestimate, cccinter
+from cccframe import CCCFrame, CCC_SIZE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TEST_SIZE = (256, 144)
+TEST_SEEDS = (1, 2, 3)
+TEST_PALETTE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "tlmir-palette.png")
+
+# SHA-1 of (encoded stream, decoded palette indices) for each seed
+GOLDEN = {
+    "default": {
+        1: ("5f1f56021531297fd301ba6fc58eb812670c266a",
+            "36bfc6708826719c07b7d71d0da87e5f493115f8"),
+        2: ("511513aa4d52449b089bfacfc27d7619e1b00c61",
+            "00b279f659b3ad5661b9890ba3f54c1304a13c5d"),
+        3: ("fe4960dcef708a054acab92815f2c8d6e8958db9",
+            "274b22d79964f96a023f3ab83b0aa7d072772c52"),
+    },
+    "quality": {
+        1: ("504f889501b631781af015448610fe72ae68de1a",
+            "2967f46e1a9128eb8b060b5eaca3f666015d9195"),
+        2: ("22e68f283efbf5f827e2dbabaeb4e963d38f8570",
+            "deaef74239f6ca8b8dc3aacd2c513b0a7c28b331"),
+        3: ("112306027535b639d21fd13a3bda7b9ce0a3ff46",
+            "51e2a5840bd940d28b2d82210158c4bb8851576f"),
+    },
+}
+
+# Minimum frames per second at TEST_SIZE, set to well under what a
+# 2020s PC achieves but above what the reference versions achieve
+MIN_FPS = {
+    "quantize": 12,
+    "quantize_quality": 8,
+    "form": 500,
+    "unpack_restore": 150,
+}
+# Minimum speed relative to a reference version timed on the same
+# machine, for steps whose reference is already fast
+MIN_SPEEDUP = {
+    "expand": 1.0,
+}
+FPS_SCALE = float(os.environ.get("CCCTEST_FPS_SCALE", "1"))
+
+def make_test_image(seed, size=TEST_SIZE):
+    """Draw a gradient with flat-colored ellipses, like a cel."""
+    rng = random.Random(seed)
+    im = Image.new("RGB", size)
+    dc = ImageDraw.Draw(im)
+    c0 = [rng.randrange(256) for i in range(3)]
+    c1 = [rng.randrange(256) for i in range(3)]
+    for y in range(size[1]):
+        color = tuple(a + (b - a) * y // size[1] for a, b in zip(c0, c1))
+        dc.line([(0, y), (size[0] - 1, y)], fill=color)
+    for i in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        r = rng.randrange(4, 40)
+        color = tuple(rng.randrange(256) for i in range(3))
+        dc.ellipse([x, y, x + r, y + r], fill=color)
+    return im
+
+def encode_test_frame(seed, neighbors=0):
+    im = make_test_image(seed)
+    bayer = ccc.make_bayer_img(im.size, 2, 129).convert("RGB")
+    palim = ccc.get_palim(TEST_PALETTE)
+    search_tables = (ccc.ccc_pair_search_tables(ccc.get_palette_colors(palim),
+                                                neighbors)
+                     if neighbors else None)
+    frame = ccc.ccc_quantize_frame(im, bayer, palim,
+                                   search_tables=search_tables)
+    return ccc.ccc_form_frame(frame), palim
+
+def sha1(data):
+    return hashlib.sha1(bytes(data)).hexdigest()
+
+def golden_hashes(mode, seed):
+    data, palim = encode_test_frame(seed, 2 if mode == "quality" else 0)
+    indices = cccdec.ccc_restore_indices(TEST_SIZE[0],
+                                         cccdec.ccc_unpack_frame(data))
+    return sha1(data), sha1(indices)
+
+# Reference versions of the codec ###################################
+
+def reference_unpack_frame(frame):
+    """Unpack to lists of color pair tuples and 16-byte shapes."""
+    blk_colorpairs = []
+    blk_shapes = []
+    for i in range(0, len(frame), 3):
+        blk_colorpairs.append((frame[i] >> 4, frame[i] & 0x0F))
+        shape_bin = frame[i + 1] << 8 | frame[i + 2]
+        blk_shapes.append(bytes([1 if (0x8000 >> i) & shape_bin else 0
+                                 for i in range(16)]))
+    return blk_colorpairs, blk_shapes
+
+def reference_form_frame(blk_colorpairs, blk_shapes):
+    out = bytearray()
+    for colorpair, shape in zip(blk_colorpairs, blk_shapes):
+        shape = (reduce(bitor,
+                        (0x8000 >> i for i, c in enumerate(shape) if c),
+                        0)
+                 if shape
+                 else 0)
+        if shape == 0xFFFF:
+            colorpair, shape = colorpair[1:], 0
+        if len(colorpair) < 2 or shape == 0:
+            out.append(colorpair[0] * 0x11)
+            out.append(0)
+            out.append(0)
+            continue
+        out.append(colorpair[0] << 4 | colorpair[1])
+        out.append(shape >> 8)
+        out.append(shape & 0xFF)
+    return bytes(out)
+
+def reference_restore_indices(width, blk_colorpairs, blk_shapes):
+    decoded_blocks = []
+    for colorpair, shape in zip(blk_colorpairs, blk_shapes):
+        if len(colorpair) < 2: shape = bytes(16)
+        decoded_blocks.append(bytes(colorpair[i] for i in shape))
+    return cccdec.blockstoimdata(decoded_blocks, width, CCC_SIZE)
+
+def reference_expand(indices, palette, size, scale):
+    """Enlarge and convert to RGB with Pillow, as cccdec once did."""
+    im = Image.frombytes("P", size, bytes(indices))
+    im.putpalette(palette)
+    out_size = (size[0] * scale, size[1] * scale)
+    im = im.resize(out_size, Image.Resampling.NEAREST)
+    return im.convert("RGB").tobytes()
+
+def reference_search_pairs(dithered, palette_colors, initial_pairs,
+                           neighbors=2):
+    """Score color pair candidates one block and one pixel at a time.
+
+Return a list of (color, shape) tuples like iterating a CCCFrame.
+"""
+    def dist(c0, c1):
+        return sum((a - b) * (a - b) for a, b in zip(c0, c1))
+    nearest = [
+        sorted(range(len(palette_colors)),
+               key=lambda j: dist(c, palette_colors[j]))[1:neighbors + 1]
+        for c in palette_colors
+    ]
+    out = []
+    for i, blk in enumerate(ccc.imtoblocks(dithered, CCC_SIZE)):
+        pixels = [blk[j:j + 3] for j in range(0, len(blk), 3)]
+        firsts = [p if len(p) > 1 else p * 2
+                  for p in (pairs[i] for pairs in initial_pairs)]
+        cands = list(firsts)
+        for a, b in firsts:
+            for n in range(neighbors):
+                cands.append((nearest[a][n], b))
+                cands.append((a, nearest[b][n]))
+        best = None
+        for a, b in cands:
+            err, shape = 0, 0
+            for px in pixels:
+                dist0 = dist(px, palette_colors[a])
+                dist1 = dist(px, palette_colors[b])
+                err += min(dist0, dist1)
+                shape = shape << 1 | (dist1 < dist0)
+            # Ties go to the earlier candidate
+            if best is None or err < best[0]:
+                best = (err, a, b, shape)
+        err, a, b, shape = best
+        out.append((a * 0x11, 0) if a == b else (a << 4 | b, shape))
+    return out
+
+def random_frame(rng, num_blocks):
+    """Make a frame of random blocks, including solid blocks."""
+    out = bytearray()
+    for i in range(num_blocks):
+        if rng.random() < 0.2:
+            out.extend((rng.randrange(16) * 0x11, 0, 0))
+        else:
+            out.extend(rng.randrange(256) for i in range(3))
+    return bytes(out)
+
+def measure_fps(fn, frames, min_seconds=0.25):
+    """Call fn on each of frames until min_seconds pass."""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for frame in frames: fn(frame)
+        count += len(frames)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds: return count / elapsed
+
+# Tests #############################################################
+
+class TestGolden(unittest.TestCase):
+    def check_mode(self, mode):
+        for seed in TEST_SEEDS:
+            with self.subTest(seed=seed):
+                self.assertEqual(golden_hashes(mode, seed),
+                                 GOLDEN[mode][seed])
+
+    def test_default(self):
+        self.check_mode("default")
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_quality(self):
+        self.check_mode("quality")
+
+class TestReference(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        num_blocks = (TEST_SIZE[0] // CCC_SIZE[0]
+                      * (TEST_SIZE[1] // CCC_SIZE[1]))
+        self.frames = [encode_test_frame(seed)[0] for seed in TEST_SEEDS]
+        self.frames.extend(random_frame(rng, num_blocks) for i in range(3))
+
+    def test_frame_bytes_round_trip(self):
+        for data in self.frames:
+            self.assertEqual(CCCFrame.from_bytes(data).to_bytes(), data)
+
+    def test_form_frame(self):
+        for data in self.frames:
+            expected = reference_form_frame(*reference_unpack_frame(data))
+            actual = ccc.ccc_form_frame(cccdec.ccc_unpack_frame(data))
+            self.assertEqual(actual, expected)
+
+    def test_restore(self):
+        for data in self.frames:
+            expected = reference_restore_indices(
+                TEST_SIZE[0], *reference_unpack_frame(data)
+            )
+            actual = cccdec.ccc_restore_indices(
+                TEST_SIZE[0], cccdec.ccc_unpack_frame(data)
+            )
+            self.assertEqual(actual, expected)
+
+    def test_expand(self):
+        palette = bytes(ccc.get_palim(TEST_PALETTE).getpalette()[:48])
+        rng = random.Random(2)
+        indices = bytes(rng.randrange(16)
+                        for i in range(TEST_SIZE[0] * TEST_SIZE[1]))
+        for scale in (1, 2, 3):
+            expected = reference_expand(indices, palette, TEST_SIZE, scale)
+            engines = [False, True] if numpy else [False]
+            for use_numpy in engines:
+                with self.subTest(scale=scale, use_numpy=use_numpy):
+                    expand = cccdec.make_rgb_expander(
+                        palette, TEST_SIZE, scale, use_numpy=use_numpy
+                    )
+                    self.assertEqual(bytes(expand(indices)), expected)
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_search_pairs(self):
+        im = make_test_image(TEST_SEEDS[0])
+        bayer = ccc.make_bayer_img(im.size, 2, 129).convert("RGB")
+        dithered = ImageChops.add(im, bayer, offset=-128)
+        palette_colors = ccc.get_palette_colors(ccc.get_palim(TEST_PALETTE))
+        rng = random.Random(5)
+        num_blocks = (TEST_SIZE[0] // CCC_SIZE[0]
+                      * (TEST_SIZE[1] // CCC_SIZE[1]))
+        first = [(rng.randrange(16),) if rng.random() < 0.2
+                 else (rng.randrange(16), rng.randrange(16))
+                 for i in range(num_blocks)]
+        # Reversed pairs score the same, which tests tie breaking
+        initial_pairs = [first, [p[::-1] for p in first],
+                         [(rng.randrange(16), rng.randrange(16))
+                          for i in range(num_blocks)]]
+        for neighbors in (0, 2):
+            with self.subTest(neighbors=neighbors):
+                expected = reference_search_pairs(
+                    dithered, palette_colors, initial_pairs, neighbors
+                )
+                search_tables = ccc.ccc_pair_search_tables(palette_colors,
+                                                           neighbors)
+                actual = ccc.ccc_search_pairs(dithered, search_tables,
+                                              initial_pairs)
+                self.assertEqual(list(actual), expected)
+
+class TestBackEnds(unittest.TestCase):
+    def setUp(self):
+        self.width_blocks = TEST_SIZE[0] // CCC_SIZE[0]
+        self.frames = [
+            cccdec.ccc_unpack_frame(encode_test_frame(seed)[0])
+            for seed in TEST_SEEDS
+        ]
+
+    def test_entropy_round_trip(self):
+        prev = CCCFrame.zeros(len(self.frames[0]))
+        coded = []
+        for frame in self.frames:
+            mask = cccinter.change_mask(frame, prev)
+            bitmap = bytearray(-(-len(mask) // 8))
+            for i, c in enumerate(mask):
+                if c: bitmap[i // 8] |= 0x80 >> (i % 8)
+            changed = frame.select([i for i, c in enumerate(mask) if c])
+            coded.append((bytes(bitmap), changed))
+            prev = frame
+        tables = cccentropy.entropy_build_tables(coded)
+        codes = cccentropy.entropy_frame_codes(tables)
+        for bitmap, blocks in coded:
+            data, bit_counts = cccentropy.entropy_encode_frame(
+                bitmap, blocks, codes
+            )
+            self.assertEqual(len(data), -(-sum(bit_counts.values()) // 8))
+            out_bitmap, out_blocks = cccentropy.entropy_decode_frame(
+                data, tables, len(self.frames[0]), True
+            )
+            self.assertEqual(out_bitmap, bitmap)
+            self.assertEqual(list(out_blocks), [
+                cccentropy.normalize_block(c, s) for c, s in blocks
+            ])
+
+    def test_entropy_one_color_shapes(self):
+        # Shapes 0 and 0xFFFF use only one color of a 2-color pair
+        blocks = CCCFrame(array("B", [0x12, 0x34, 0x56]),
+                          array("H", [0, 0xFFFF, 0x0F0F]))
+        tables = cccentropy.entropy_build_tables([(None, blocks)])
+        codes = cccentropy.entropy_frame_codes(tables)
+        data, bit_counts = cccentropy.entropy_encode_frame(None, blocks, codes)
+        out_bitmap, out_blocks = cccentropy.entropy_decode_frame(
+            data, tables, len(blocks), False
+        )
+        self.assertEqual(list(out_blocks),
+                         [(0x11, 0), (0x44, 0), (0x56, 0x0F0F)])
+
+    def test_change_rows_round_trip(self):
+        rng = random.Random(3)
+        height_blocks = len(self.frames[0]) // self.width_blocks
+        for density in (0.0, 0.05, 0.5, 1.0):
+            mask = bytes(rng.random() < density
+                         for i in range(len(self.frames[0])))
+            bits = cccinter.encode_change_rows(mask, self.width_blocks)
+            out, pos = cccinter.decode_change_rows(
+                bits, 0, self.width_blocks, height_blocks
+            )
+            self.assertEqual((out, pos), (mask, len(bits)))
+
+    def test_motion_pan(self):
+        # Shift a frame left by 2 blocks, as in a pan
+        prev = self.frames[0]
+        cur = CCCFrame()
+        blocks = list(prev)
+        for y in range(0, len(blocks), self.width_blocks):
+            row = blocks[y:y + self.width_blocks]
+            for color, shape in row[2:] + row[-1:] * 2:
+                cur.colors.append(color)
+                cur.shapes.append(shape)
+        vectors = cccinter.motion_search(cur, prev, self.width_blocks)
+        bits = cccinter.encode_vectors(vectors)
+        out, pos = cccinter.decode_vectors(bits, 0, len(vectors))
+        self.assertEqual((out, pos), (vectors, len(bits)))
+        pred = cccinter.motion_predict(prev, self.width_blocks, vectors)
+        self.assertLess(sum(cccinter.change_mask(cur, pred)),
+                        sum(cccinter.change_mask(cur, prev)) // 4)
+
+@unittest.skipIf(numpy is None, "numpy not installed")
+class TestCorpus(unittest.TestCase):
+    video_size = (32, 16)
+    num_buckets = 4
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        header = ccc.ccc_form_header(self.video_size,
+                                     ccc.get_palim(TEST_PALETTE))
+        num_blocks = ((self.video_size[0] // CCC_SIZE[0])
+                      * (self.video_size[1] // CCC_SIZE[1]))
+        rng = random.Random(4)
+        self.videos = {}
+        for name, frame_count in (("a.ccc1", 11), ("b.ccc1", 6)):
+            # Repeat most frames, some partly, so that inter coding
+            # skips blocks within and across buckets and chunks
+            frames = []
+            data = random_frame(rng, num_blocks)
+            for i in range(frame_count):
+                if i % 3 == 0:
+                    data = random_frame(rng, num_blocks)
+                elif i % 3 == 2:
+                    data = data[:30] + random_frame(rng, num_blocks)[30:]
+                frames.append(CCCFrame.from_bytes(data))
+            filename = os.path.join(self.tmpdir.name, name)
+            with open(filename, "wb") as outfp:
+                outfp.write(header)
+                outfp.write(b"".join(f.to_bytes() for f in frames))
+            self.videos[filename] = frames
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def expected_usage(self, frames, inter):
+        """Count normalized shapes in each bucket one block at a time."""
+        usage = []
+        prev = CCCFrame.zeros(len(frames[0]))
+        for b in range(self.num_buckets):
+            start = len(frames) * b // self.num_buckets
+            end = len(frames) * (b + 1) // self.num_buckets
+            counts = Counter()
+            for frame in frames[start:end]:
+                coded = cccestimate.try_inter(frame, prev) if inter else frame
+                counts.update(cccentropy.normalize_block(color, shape)[1]
+                              for color, shape in coded)
+                prev = frame
+            usage.append(counts)
+        return usage
+
+    def test_count_file(self):
+        for filename, frames in self.videos.items():
+            for inter in (False, True):
+                for chunk_frames in (1, 2, 64):
+                    with self.subTest(filename=filename, inter=inter,
+                                      chunk_frames=chunk_frames):
+                        result = cccestimate.corpus_count_file(
+                            (filename, self.num_buckets, inter), chunk_frames
+                        )
+                        _, frame_count, hist, usage, bucket_frames = result
+                        expected = self.expected_usage(frames, inter)
+                        self.assertEqual(frame_count, len(frames))
+                        self.assertEqual(int(bucket_frames.sum()),
+                                         len(frames))
+                        for b, counts in enumerate(expected):
+                            nonzero = usage[b].nonzero()[0]
+                            self.assertEqual(
+                                {int(s): int(usage[b, s]) for s in nonzero},
+                                dict(counts)
+                            )
+                        self.assertEqual(int(hist.sum()),
+                                         sum(sum(c.values())
+                                             for c in expected))
+
+    def test_merge_and_skip(self):
+        empty = os.path.join(self.tmpdir.name, "empty.ccc1")
+        open(empty, "wb").close()
+        codebook = os.path.join(self.tmpdir.name, "codebook.bin")
+        argv = ["cccestimate.py", *self.videos, empty, "--inter",
+                "-j", "2", "--top", "20", "--codebook", codebook]
+        out, err = StringIO(), StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            cccestimate.main(argv)
+        self.assertIn("empty.ccc1", err.getvalue())
+
+        total = Counter()
+        for frames in self.videos.values():
+            for counts in self.expected_usage(frames, True):
+                total += counts
+        self.assertIn("2 files, %d frames, %d blocks counted"
+                      % (sum(map(len, self.videos.values())),
+                         sum(total.values())), out.getvalue())
+        ranked = sorted((shape for shape in total if shape),
+                        key=lambda shape: (-total[shape], shape))[:20]
+        with open(codebook, "rb") as infp:
+            data = infp.read()
+        shapes = [int.from_bytes(data[i:i + 2], "big")
+                  for i in range(0, len(data), 2)]
+        self.assertEqual(shapes, ranked)
+        # cccentropy codebooks hold only shapes with bit 15 clear
+        self.assertFalse([shape for shape in shapes if shape & 0x8000])
+
+@unittest.skipUnless(FPS_SCALE > 0, "CCCTEST_FPS_SCALE is 0")
+class TestThroughput(unittest.TestCase):
+    def setUp(self):
+        self.data = [encode_test_frame(seed)[0] for seed in TEST_SEEDS]
+        self.frames = [cccdec.ccc_unpack_frame(d) for d in self.data]
+
+    def check_fps(self, name, fn, frames):
+        fps = measure_fps(fn, frames)
+        self.assertGreaterEqual(fps, MIN_FPS[name] * FPS_SCALE,
+                                "%s: %.1f frames/s" % (name, fps))
+
+    def check_quantize_fps(self, name, neighbors=0):
+        ims = [make_test_image(seed) for seed in TEST_SEEDS]
+        bayer = ccc.make_bayer_img(TEST_SIZE, 2, 129).convert("RGB")
+        palim = ccc.get_palim(TEST_PALETTE)
+        search_tables = None
+        if neighbors:
+            search_tables = ccc.ccc_pair_search_tables(
+                ccc.get_palette_colors(palim), neighbors
+            )
+        def quantize(im):
+            ccc.ccc_quantize_frame(im, bayer, palim,
+                                   search_tables=search_tables)
+        self.check_fps(name, quantize, ims)
+
+    def test_quantize(self):
+        self.check_quantize_fps("quantize")
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_quantize_quality(self):
+        self.check_quantize_fps("quantize_quality", 2)
+
+    def test_form(self):
+        self.check_fps("form", ccc.ccc_form_frame, self.frames)
+
+    def test_unpack_restore(self):
+        width = TEST_SIZE[0]
+        def unpack_restore(data):
+            cccdec.ccc_restore_indices(width, cccdec.ccc_unpack_frame(data))
+        self.check_fps("unpack_restore", unpack_restore, self.data)
+
+    def check_speedup(self, name, fn, reference_fn, frames, rounds=3):
+        # Alternate and keep the best of each to ride out load spikes
+        fps = reference_fps = 0
+        for i in range(rounds):
+            reference_fps = max(reference_fps,
+                                measure_fps(reference_fn, frames))
+            fps = max(fps, measure_fps(fn, frames))
+        self.assertGreaterEqual(fps, MIN_SPEEDUP[name] * reference_fps,
+                                "%s: %.1f frames/s, reference %.1f"
+                                % (name, fps, reference_fps))
+
+    def test_expand(self):
+        palette = bytes(ccc.get_palim(TEST_PALETTE).getpalette()[:48])
+        indices = [cccdec.ccc_restore_indices(TEST_SIZE[0], f)
+                   for f in self.frames]
+        def reference(data):
+            reference_expand(data, palette, TEST_SIZE, 2)
+        engines = [False, True] if numpy else [False]
+        for use_numpy in engines:
+            with self.subTest(use_numpy=use_numpy):
+                expand = cccdec.make_rgb_expander(palette, TEST_SIZE, 2,
+                                                  use_numpy=use_numpy)
+                self.check_speedup("expand", expand, reference, indices)
+
+def print_golden():
+    print("GOLDEN = {")
+    for mode in GOLDEN:
+        print('    "%s": {' % mode)
+        for seed in TEST_SEEDS:
+            print('        %d: ("%s",\n            "%s"),'
+                  % (seed, *golden_hashes(mode, seed)))
+        print("    },")
+    print("}")
+
+if __name__=='__main__':
+    if "--print-golden" in sys.argv:
+        print_golden()
+    else:
+        unittest.main()
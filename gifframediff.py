@@ -8,13 +8,21 @@ SPDX-License-Identifier: Zlib
 """
 import os, sys, argparse
 from PIL import Image, ImageChops
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    plt = None
 
-def main():
-    filename = "out-non-ccc.gif"
+def parse_argv(argv):
+    p = argparse.ArgumentParser(
+        description="Counts 4x4-pixel cells that change between GIF frames"
+    )
+    p.add_argument("input", nargs="?", default="out-non-ccc.gif",
+                   help="16-color GIF (default: out-non-ccc.gif)")
+    p.add_argument("--plot", action="store_true",
+                   help="graph changed cells per frame "
+                        "(requires matplotlib)")
+    return p.parse_args(argv[1:])
+
+def main(argv=None):
+    args = parse_argv(argv or sys.argv)
+    filename = args.input
     frames_per_row = 24
     COLOR_CELL_W = 4
     COLOR_CELL_H = 4
@@ -60,9 +68,11 @@ def main():
 
 
     diff_contact.save("gif_diff_contact.png")
-    if plt:
+    if args.plot:
+        import matplotlib.pyplot as plt
         plt.plot(range(len(unchanged)),
                  [size_cells[0] * size_cells[1] - u for u in unchanged])
+        plt.show()
 
 if __name__=='__main__':
     main()
@@ -5,27 +5,32 @@ Attempt to detect shot bounds, such as for palette changes
 Copyright 2025 Damian Yerrick
 SPDX-License-Identifier: Zlib
 """
-import os, sys, argparse, subprocess
+import os, sys, argparse
 from PIL import Image, ImageChops, ImageStat, ImageFont, ImageDraw, ImageFilter
-import matplotlib.pyplot as plt
+from ccc import PIL_get_frames, ffprobe_size, parse_size
 
-def get_frames(filename, size):
-    args = [
-        "ffmpeg", "-i", filename,
-        "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
-    ]
-    proc = subprocess.Popen(args, stdout=subprocess.PIPE)
-    while True:
-        im = proc.stdout.read(size[0] * size[1] * 3)
-        if not im: break
-        yield im
+def parse_argv(argv):
+    p = argparse.ArgumentParser(
+        description="Finds shot changes by differencing successive frames"
+    )
+    p.add_argument("input", nargs="?", default="build/source.avi",
+                   help="video file readable by FFmpeg "
+                        "(default: build/source.avi)")
+    p.add_argument("--size", type=parse_size,
+                   help="video size, such as 256x144 (default: ask ffprobe)")
+    p.add_argument("--contact", default="shotbounds.jpg", metavar="JPGFILE",
+                   help="where to save detected keyframes "
+                        "(default: shotbounds.jpg)")
+    p.add_argument("--trace-frame", type=int,
+                   help="frame number whose difference to show")
+    p.add_argument("--plot", action="store_true",
+                   help="graph the differences (requires matplotlib)")
+    return p.parse_args(argv[1:])
 
-def PIL_get_frames(filename, size):
-    for rawim in get_frames(filename, size):
-        yield Image.frombytes("RGB", size, rawim)
-
-def main():
-    it = PIL_get_frames("build/source.avi", (256, 144))
+def main(argv=None):
+    args = parse_argv(argv or sys.argv)
+    video_size = args.size or ffprobe_size(args.input)
+    it = PIL_get_frames(args.input, video_size)
     prevframe = None
     pcts = [0.0]
     SHOT_THRESHOLD = 80
@@ -38,7 +43,7 @@ def main():
             diff = diff.convert("L", matrix=(.25, .5, .25, 0))
             diff = diff.filter(dilation)
             diff = diff.point(lambda x: min(255, x*17))
-            if i == 24: diff.show()
+            if i == args.trace_frame: diff.show()
 
             diff_divisor = diff.size[0] * diff.size[1] * 255
             diffstat = ImageStat.Stat(diff)
@@ -70,7 +75,12 @@ def main():
             paste_y, paste_x = divmod(kfindex, kf_per_row)
             kf_contact.paste(annotated,
                              (paste_x * kf_size[0], paste_y * kf_size[1]))
-        kf_contact.save("shotbounds.jpg")
+        kf_contact.save(args.contact)
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plt.plot(range(len(pcts)), pcts)
+        plt.show()
 
-    plt.plot(range(len(pcts)), pcts)
-    plt.show()
+if __name__=='__main__':
+    main()